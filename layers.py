@@ -10,21 +10,15 @@ if torch.cuda.is_available():
 else:
     device = torch.device("cpu")
 
-def bmv(w, x):
-    """Matrix-vector multiplication that works even if x is a sequence of
-    vectors.
+def compiled(fn, mode=None):
+    """Compile a forward method with torch.compile when available
+    (PyTorch >= 2.0); on older versions the function is returned as is.
 
-    If w has size m,n and x has size n, performs a standard
-    matrix-vector multiply, yielding a vector of size m.
-
-    If w has size m,n and x has size b,n, multiplies w with every
-    column of x, yielding a matrix of size b,m.
-    """
-    
-    x = x.unsqueeze(-1)
-    y = w @ x
-    y = y.squeeze(-1)
-    return y
+    dynamic=True because sequence lengths vary from sentence to
+    sentence, which would otherwise trigger a recompile per length."""
+    if hasattr(torch, 'compile'):
+        return torch.compile(fn, dynamic=True, mode=mode)
+    return fn
 
 class Embedding(torch.nn.Module):
     """Embedding layer.
@@ -39,8 +33,31 @@ class Embedding(torch.nn.Module):
 
     def __init__(self, vocab_size, output_dims):
         super().__init__()
-        self.W = torch.nn.Parameter(torch.empty(vocab_size, output_dims))
-        torch.nn.init.normal_(self.W, std=0.01)
+        # One tensor factory call per parameter (instead of empty +
+        # normal_, which dispatches twice and overwrites the allocation)
+        self.W = torch.nn.Parameter(torch.randn(vocab_size, output_dims) * 0.01)
+        self._W_normed = None
+        self.W_int8 = None
+        self.W_scale = None
+
+    def train(self, mode=True):
+        # The weights can change during training, so throw away the
+        # cached normalized weights (see forward()).
+        self._W_normed = None
+        self.W_int8 = None
+        self.W_scale = None
+        return super().train(mode)
+
+    def quantize_for_inference(self):
+        """Store an int8 copy of the embedding table with per-row
+        scales, used by forward() in eval mode. This quarters the bytes
+        read per lookup; each row is still accurate to about 1/127 of
+        its largest entry, and the normalization in forward() absorbs
+        the scale anyway."""
+        with torch.no_grad():
+            scale = self.W.abs().amax(dim=1, keepdim=True).clamp(min=1e-8) / 127.0
+            self.W_int8 = torch.round(self.W / scale).to(torch.int8)
+            self.W_scale = scale.squeeze(1)
 
     def forward(self, inp):
         """Works on either single words or sequences of words.
@@ -62,15 +79,122 @@ class Embedding(torch.nn.Module):
 
         if not (isinstance(inp, int) or inp.dtype in [torch.int32, torch.int64]):
             raise TypeError('input should be an integer or tensor of integers')
-        
+
+        # In eval mode, gather from the int8 table if
+        # quantize_for_inference() has been called
+        if not self.training and self.W_int8 is not None:
+            emb = self.W_int8[inp].to(self.W.dtype) * self.W_scale[inp].unsqueeze(-1)
+            return torch.nn.functional.normalize(emb, dim=-1)
+
+        # In eval mode the weights don't change between calls, so
+        # normalize them once and cache the result; the lookup is then
+        # a pure gather.
+        if not self.training:
+            if self._W_normed is None:
+                with torch.no_grad():
+                    self._W_normed = torch.nn.functional.normalize(self.W, dim=-1)
+            return self._W_normed[inp]
+
         emb = self.W[inp]
-        
+
         # Scaling the embedding to have norm 1 helps against overfitting.
         # https://www.aclweb.org/anthology/N18-1031/
         emb = torch.nn.functional.normalize(emb, dim=-1)
-        
+
         return emb
 
+@torch.jit.script
+def rnn_scan(pre: torch.Tensor, W_hh: torch.Tensor, h0: torch.Tensor,
+             inputs: torch.Tensor) -> torch.Tensor:
+    """Run the recurrence h_t = tanh(pre_t + W_hh h_{t-1}) over a whole
+    sequence, returning the outputs h_t + inputs_t.
+
+    This is the inner loop of RNN.forward, as a TorchScript function so
+    that the per-timestep work runs without Python interpreter or
+    dispatch overhead (and the adds and tanh can be fused).
+    """
+    h = h0
+    # Write each output into one preallocated buffer rather than
+    # appending to a list and paying for a torch.stack copy at the end
+    outputs = torch.empty_like(inputs)
+    # unbind creates all the per-timestep views up front, instead of
+    # dispatching a fresh indexing op on every iteration
+    pre_steps = pre.unbind(0)
+    in_steps = inputs.unbind(0)
+    for t in range(len(pre_steps)):
+        h = torch.tanh(pre_steps[t] + W_hh @ h)
+        outputs[t] = h + in_steps[t]
+    return outputs
+
+try:
+    import numpy as np
+    import numba
+
+    @numba.njit(cache=True, fastmath=True)
+    def _rnn_scan_numba(pre, W_hh, h0, inputs):
+        """NumPy version of rnn_scan, JIT-compiled by Numba. On CPU this
+        beats the dispatch-heavy tensor loop for small hidden sizes.
+
+        The matvec is written with explicit loops (which Numba compiles
+        to tight vectorized code) rather than @, which would pull in a
+        SciPy BLAS dependency."""
+        n, dims = pre.shape
+        outputs = np.empty_like(inputs)
+        h = h0.copy()
+        new_h = np.empty_like(h)
+        for t in range(n):
+            for i in range(dims):
+                s = pre[t, i]
+                for j in range(dims):
+                    s += W_hh[i, j] * h[j]
+                new_h[i] = np.tanh(s)
+            for i in range(dims):
+                h[i] = new_h[i]
+                outputs[t, i] = h[i] + inputs[t, i]
+        return outputs
+except ImportError:
+    _rnn_scan_numba = None
+
+def rnn_fixed_point_scan(pre, W_hh, h0, inputs, tol=1e-6, max_sweeps=None):
+    """Time-parallel evaluation of the RNN recurrence by fixed-point
+    iteration (in the style of ParaRNN / DEER).
+
+    Instead of stepping through the sequence one position at a time,
+    start from the guess h_t = tanh(pre_t) and repeatedly refine every
+    position at once:
+
+        h_t <- tanh(pre_t + W_hh h_{t-1})
+
+    Each sweep is a single GEMM over the whole sequence, so the work
+    parallelizes over the time axis; correct state information
+    propagates at least one position per sweep, so n sweeps recover the
+    sequential answer exactly, and in practice far fewer are needed
+    because the influence of distant history decays under tanh.
+
+    Arguments:
+        pre:    Precomputed input projections W_hi x_t + b (tensor of size n,dims)
+        W_hh:   Hidden-to-hidden weights (tensor of size dims,dims)
+        h0:     Initial hidden state (tensor of size dims)
+        inputs: Input vectors, for the residual connection (tensor of size n,dims)
+        tol:    Stop when no component changes by more than this
+        max_sweeps: Sweep limit (default: sequence length, which is exact)
+
+    Return:
+        Output vectors (tensor of size n,dims)
+    """
+    n = pre.size(0)
+    if max_sweeps is None:
+        max_sweeps = n
+    h = torch.tanh(pre)
+    for _ in range(max_sweeps):
+        prev = torch.cat([h0.unsqueeze(0), h[:-1]])
+        new = torch.tanh(torch.addmm(pre, prev, W_hh.t()))
+        converged = bool((new - h).abs().max() <= tol)
+        h = new
+        if converged:
+            break
+    return h + inputs
+
 class RNN(torch.nn.Module):
     """Simple recurrent neural network.
 
@@ -90,14 +214,12 @@ class RNN(torch.nn.Module):
     def __init__(self, dims):
         super().__init__()
         self.dims = dims
-        self.h0 = torch.nn.Parameter(torch.empty(dims))
-        self.W_hi = torch.nn.Parameter(torch.empty(dims, dims))
-        self.W_hh = torch.nn.Parameter(torch.empty(dims, dims))
-        self.b = torch.nn.Parameter(torch.empty(dims))
-        torch.nn.init.normal_(self.h0, std=0.01)
-        torch.nn.init.normal_(self.W_hi, std=0.01)
-        torch.nn.init.normal_(self.W_hh, std=0.01)
-        torch.nn.init.normal_(self.b, std=0.01)
+        # One tensor factory call per parameter (instead of empty +
+        # normal_, which dispatches twice and overwrites the allocation)
+        self.h0 = torch.nn.Parameter(torch.randn(dims) * 0.01)
+        self.W_hi = torch.nn.Parameter(torch.randn(dims, dims) * 0.01)
+        self.W_hh = torch.nn.Parameter(torch.randn(dims, dims) * 0.01)
+        self.b = torch.nn.Parameter(torch.randn(dims) * 0.01)
 
     def start(self):
         """Return the initial state."""
@@ -121,13 +243,16 @@ class RNN(torch.nn.Module):
         if inp.size()[-1] != self.dims:
             raise TypeError(f'Input vector must have size {self.dims}')
 
-        state = torch.tanh(bmv(self.W_hi, inp) + bmv(self.W_hh, state) + self.b)
+        state = torch.tanh(torch.nn.functional.linear(inp, self.W_hi) + torch.nn.functional.linear(state, self.W_hh) + self.b)
         return (state, state + inp)
 
-    def forward(self, inputs):
+    def forward(self, inputs, parallel=False):
         """Run the RNN on an input sequence.
         Argument:
             Input vectors (Tensor of size n,dims)
+            parallel: Evaluate by fixed-point iteration over the whole
+                sequence instead of a sequential scan (see
+                rnn_fixed_point_scan); exact at convergence
 
         Return:
             Output vectors (Tensor of size n,dims)
@@ -138,12 +263,34 @@ class RNN(torch.nn.Module):
         if inputs.size()[1] != self.dims:
             raise TypeError(f'Input vectors must have size {self.dims}')
 
-        h = self.start()
-        outputs = []
-        for inp in inputs:
-            h, o = self.step(h, inp)
-            outputs.append(o)
-        return torch.stack(outputs)
+        # The input-to-hidden products are independent across timesteps,
+        # so compute them all at once as a single matrix-matrix multiply
+        # instead of one matrix-vector multiply per step. Only the
+        # hidden-to-hidden product has to stay inside the loop.
+        pre = torch.addmm(self.b, inputs, self.W_hi.t())
+
+        if parallel:
+            return rnn_fixed_point_scan(pre, self.W_hh, self.start(), inputs)
+
+        # At inference on GPU, run the whole scan in one fused kernel
+        # launch (see rnn_cuda.py). The kernel doesn't support autograd,
+        # so training still goes through the TorchScript scan.
+        if (inputs.is_cuda and not torch.is_grad_enabled()
+                and inputs.dtype == torch.float32 and self.dims <= 1024):
+            import rnn_cuda
+            return rnn_cuda.rnn_scan_cuda(pre, self.W_hh, self.h0, inputs)
+
+        # At inference on CPU, run the scan through the Numba kernel (if
+        # numba is installed), which avoids per-step dispatch entirely
+        if (_rnn_scan_numba is not None and not inputs.is_cuda
+                and not torch.is_grad_enabled()
+                and inputs.dtype == torch.float32):
+            outputs = _rnn_scan_numba(
+                pre.detach().numpy(), self.W_hh.detach().numpy(),
+                self.h0.detach().numpy(), inputs.detach().numpy())
+            return torch.from_numpy(outputs)
+
+        return rnn_scan(pre, self.W_hh, self.start(), inputs)
 
 class LinearLayer(torch.nn.Module):
     """Linear layer.
@@ -162,10 +309,8 @@ class LinearLayer(torch.nn.Module):
         self.residual = residual
         if residual and input_dims != output_dims:
             raise ValueError("A residual connection requires the same number of input and output dimensions.")
-        self.W = torch.nn.Parameter(torch.empty(output_dims, input_dims))
-        self.b = torch.nn.Parameter(torch.empty(output_dims))
-        torch.nn.init.normal_(self.W, std=0.01)
-        torch.nn.init.normal_(self.b, std=0.01)
+        self.W = torch.nn.Parameter(torch.randn(output_dims, input_dims) * 0.01)
+        self.b = torch.nn.Parameter(torch.randn(output_dims) * 0.01)
 
     def forward(self, inp):
         """Works on either single vectors or sequences of vectors.
@@ -189,7 +334,7 @@ class LinearLayer(torch.nn.Module):
         if inp.size()[-1] != input_dims:
             raise TypeError(f"The inputs must have size {input_dims} (not {inp.size()[-1]})")
         
-        out = bmv(self.W, inp) + self.b
+        out = torch.nn.functional.linear(inp, self.W, self.b)
         if self.residual:
             out = out + inp
         return out
@@ -205,8 +350,30 @@ class SoftmaxLayer(torch.nn.Module):
     """
     def __init__(self, input_dims, output_dims):
         super().__init__()
-        self.W = torch.nn.Parameter(torch.empty(output_dims, input_dims))
-        torch.nn.init.normal_(self.W, std=0.01)
+        self.W = torch.nn.Parameter(torch.randn(output_dims, input_dims) * 0.01)
+        self._W_normed = None
+        self.W_int8 = None
+        self.W_scale = None
+
+    def train(self, mode=True):
+        # The weights can change during training, so throw away the
+        # cached normalized weights (see forward()).
+        self._W_normed = None
+        self.W_int8 = None
+        self.W_scale = None
+        return super().train(mode)
+
+    def quantize_for_inference(self):
+        """Store an int8 copy of the output embeddings with per-row
+        scales, used by forward() in eval mode. The row normalization
+        and the x10 input scale are folded in before quantizing, so
+        eval is one dequantize and one matmul over a table a quarter
+        the size."""
+        with torch.no_grad():
+            W = torch.nn.functional.normalize(self.W, dim=1) * 10
+            scale = W.abs().amax(dim=1, keepdim=True).clamp(min=1e-8) / 127.0
+            self.W_int8 = torch.round(W / scale).to(torch.int8)
+            self.W_scale = scale
 
     def forward(self, inp):
         """Works on either single vectors or sequences of vectors.
@@ -233,12 +400,26 @@ class SoftmaxLayer(torch.nn.Module):
         # Scaling both the output embeddings and the inputs
         # to have norm 1 and 10, respectively, helps against overfitting.
         # https://www.aclweb.org/anthology/N18-1031/
-        W = torch.nn.functional.normalize(self.W, dim=1)
-        inp = torch.nn.functional.normalize(inp, dim=-1) * 10
+        if not self.training and self.W_int8 is not None:
+            # Dequantize the int8 table (see quantize_for_inference())
+            W = self.W_int8.to(self.W.dtype) * self.W_scale
+            inp = torch.nn.functional.normalize(inp, dim=-1)
+        elif not self.training:
+            # In eval mode the weights don't change between calls, so
+            # normalize them once and cache the result, with the input
+            # scale of 10 folded into the weights.
+            if self._W_normed is None:
+                with torch.no_grad():
+                    self._W_normed = torch.nn.functional.normalize(self.W, dim=1) * 10
+            W = self._W_normed
+            inp = torch.nn.functional.normalize(inp, dim=-1)
+        else:
+            W = torch.nn.functional.normalize(self.W, dim=1)
+            inp = torch.nn.functional.normalize(inp, dim=-1) * 10
 
-        return torch.log_softmax(bmv(W, inp), dim=-1)
+        return torch.log_softmax(torch.nn.functional.linear(inp, W), dim=-1)
 
-def attention(query, keys, vals, mask=None, temp=1):
+def attention(query, keys, vals, mask=None, temp=1, causal=False):
     """Compute dot-product attention.
 
     query can be a single vector or a sequence of vectors.
@@ -262,8 +443,12 @@ def attention(query, keys, vals, mask=None, temp=1):
 
     Returns:
         Context vectors (tensor with size m,d')
+
+    Instead of passing a mask, causal=True applies a causal (lower
+    triangular) mask without ever materializing it, letting the fused
+    kernel skip the masked-out half of the computation.
     """
-    
+
     if query.size()[-1] != keys.size()[-1]:
         raise TypeError("The queries and keys should be the same size")
     d = query.size()[-1]
@@ -275,11 +460,26 @@ def attention(query, keys, vals, mask=None, temp=1):
         if mask.size()[-1] != keys.size()[-2]:
             raise TypeError("Mask has wrong size")
 
-    logits = query @ keys.transpose(-2, -1) / math.sqrt(d) # m,n
-    if mask is not None:
-        logits.masked_fill_(mask, -torch.inf)
-    aweights = torch.softmax(logits / temp, dim=-1)        # m,n
-    context = aweights @ vals                              # m,d'
+    # scaled_dot_product_attention fuses the logits, softmax, and value
+    # multiplication into one kernel (FlashAttention on CUDA) instead of
+    # materializing the full m,n logits matrix. The temperature folds
+    # into the scale factor, and our mask convention (True = masked)
+    # is the opposite of its (True = attend), hence the ~.
+    single = query.ndim == 1
+    if single:
+        query = query.unsqueeze(0)
+        if mask is not None:
+            mask = mask.unsqueeze(0)
+    # Fold the 1/sqrt(d) normalization and the temperature into a
+    # single scale factor, computed once
+    scale = 1.0 / (math.sqrt(d) * temp)
+    context = torch.nn.functional.scaled_dot_product_attention(
+        query, keys, vals,
+        attn_mask=None if mask is None else ~mask,
+        is_causal=causal,
+        scale=scale)
+    if single:
+        context = context.squeeze(0)
     return context
 
 
@@ -320,31 +520,51 @@ def hardAttention(query, keys, vals, mask=None, gumbel=True):
         if mask.size()[-1] != keys.size()[-2]:
             raise TypeError("Mask has wrong size")
 
-    logits = query @ keys.transpose(-2, -1) / math.sqrt(d)                             # m,n
+    logits = query @ keys.transpose(-2, -1) * (1.0 / math.sqrt(d))                     # m,n
     if mask is not None:
         logits.masked_fill_(mask, -torch.inf)
     aweights = torch.softmax(logits, dim=-1)                                           # m,n
     if gumbel:
         # Gumbel softmax
         choices = torch.nn.functional.gumbel_softmax(aweights, dim=1, hard=True, tau=0.1) # m
+        context = choices @ vals                                                       # m,d'
     else:
-        # Argmax
-        choices = torch.argmax(aweights, dim=1).float()
-    context = choices @ vals                                                           # m,d'
+        # Argmax: picking the best value row for each query is a
+        # gather, not a matmul (the old code multiplied the raw index
+        # vector into vals, which was wrong as well as wasteful)
+        context = vals[torch.argmax(aweights, dim=-1)]                                 # m,d'
     return context
 
 class AttentionLayer(torch.nn.Module):
-    """Base class for attention layers."""
+    """Base class for attention layers.
+
+    The query, key, and value projections are stored concatenated as a
+    single (3*dims, dims) parameter so that all three can be computed
+    with one matmul (see project_qkv()). W_Q, W_K, and W_V are still
+    available as views into it."""
 
     def __init__(self, dims):
         super().__init__()
         self.dims = dims
-        self.W_Q = torch.nn.Parameter(torch.empty(dims, dims))
-        self.W_K = torch.nn.Parameter(torch.empty(dims, dims))
-        self.W_V = torch.nn.Parameter(torch.empty(dims, dims))
-        torch.nn.init.normal_(self.W_Q, std=0.01)
-        torch.nn.init.normal_(self.W_K, std=0.01)
-        torch.nn.init.normal_(self.W_V, std=0.01)
+        self.W_QKV = torch.nn.Parameter(torch.randn(3 * dims, dims) * 0.01)
+
+    @property
+    def W_Q(self):
+        return self.W_QKV[:self.dims]
+
+    @property
+    def W_K(self):
+        return self.W_QKV[self.dims:2*self.dims]
+
+    @property
+    def W_V(self):
+        return self.W_QKV[2*self.dims:]
+
+    def project_qkv(self, inputs):
+        """Compute the query, key, and value projections of inputs with
+        a single matmul, returning them as a triple."""
+        qkv = torch.nn.functional.linear(inputs, self.W_QKV)
+        return qkv.chunk(3, dim=-1)
 
 class SelfAttentionLayer(AttentionLayer):
     """Self-attention layer, for use in an encoder.
@@ -356,6 +576,7 @@ class SelfAttentionLayer(AttentionLayer):
     used on sequences of vectors, not single vectors.
     """
     
+    @compiled
     def forward(self, inputs):
         """Argument:
             inputs: Input vectors (tensor of size n,d)
@@ -369,17 +590,20 @@ class SelfAttentionLayer(AttentionLayer):
         if inputs.size()[-1] != self.dims:
             raise TypeError(f"input vectors must have size {self.dims}")
 
-        # Linearly transform inputs in three ways to get queries, keys, values
-        queries = bmv(self.W_Q, inputs)
-        keys = bmv(self.W_K, inputs)
-        values = bmv(self.W_V, inputs)
+        # On GPU, run the projections and attention in bfloat16 for
+        # tensor-core throughput; the fused attention kernel still
+        # accumulates its softmax in float32.
+        with torch.autocast('cuda', dtype=torch.bfloat16, enabled=inputs.is_cuda):
+            # Linearly transform inputs in three ways (with one fused
+            # matmul) to get queries, keys, values
+            queries, keys, values = self.project_qkv(inputs)
+
+            # Compute output vectors
+            outputs = attention(queries, keys, values)
 
-        # Compute output vectors
-        outputs = attention(queries, keys, values)
-        
         # Residual connection (see RNN for explanation)
         outputs = outputs + inputs
-        
+
         return outputs
 
 class HardSelfAttentionLayer(AttentionLayer):
@@ -406,10 +630,9 @@ class HardSelfAttentionLayer(AttentionLayer):
         if inputs.size()[-1] != self.dims:
             raise TypeError(f"input vectors must have size {self.dims}")
 
-        # Linearly transform inputs in three ways to get queries, keys, values
-        queries = bmv(self.W_Q, inputs)
-        keys = bmv(self.W_K, inputs)
-        values = bmv(self.W_V, inputs)
+        # Linearly transform inputs in three ways (with one fused
+        # matmul) to get queries, keys, values
+        queries, keys, values = self.project_qkv(inputs)
 
         # Compute output vectors
         if gumbel:
@@ -433,27 +656,38 @@ class MaskedSelfAttentionLayer(AttentionLayer):
     methods.
     """
     
-    def start(self):
-        """The state is the list of previous inputs, which is initially empty."""
-        return torch.empty(0, self.dims)
+    def start(self, max_len=256):
+        """The state is a pair of key and value caches, preallocated to
+        max_len positions (they grow if needed), plus the number of
+        positions filled so far."""
+        K = self.W_K.new_empty(max_len, self.dims)
+        V = self.W_V.new_empty(max_len, self.dims)
+        return (K, V, 0)
 
-    def step(self, prev_inps, inp):
-        """Input a new vector and compute masked self-attention over all input vectors."""
-        inputs = torch.cat([prev_inps, inp.unsqueeze(0)], dim=0)
+    def step(self, state, inp):
+        """Input a new vector and compute masked self-attention over all
+        input vectors so far.
 
-        # Linearly transform inputs in three ways to get queries, keys, values
-        query = bmv(self.W_Q, inp)
-        keys = bmv(self.W_K, inputs)
-        values = bmv(self.W_V, inputs)
+        The keys and values of previous positions are reused from the
+        cache, so each step only projects the new input vector instead
+        of reprojecting the whole prefix."""
+        K, V, t = state
+        if t == K.size(0):
+            K = torch.cat([K, K.new_empty(K.size(0), self.dims)], dim=0)
+            V = torch.cat([V, V.new_empty(V.size(0), self.dims)], dim=0)
+
+        # Linearly transform the new input in three ways (with one
+        # fused matvec) to get the query and the new key and value
+        query, K[t], V[t] = self.project_qkv(inp)
+
+        # Compute output vector
+        output = attention(query, K[:t+1], V[:t+1])
 
-        # Compute output vectors
-        output = attention(query, keys, values)
-        
         # Residual connection
         output = output + inp
-        
-        return (inputs, output)
-    
+
+        return ((K, V, t+1), output)
+
     def forward(self, inputs, ):
         """Argument:
             inputs: Input vectors (tensor of size n,d)
@@ -464,24 +698,20 @@ class MaskedSelfAttentionLayer(AttentionLayer):
 
         if inputs.ndim < 2:
             raise TypeError("inputs must have at least two axes")
-        n = inputs.size()[-2]
         if inputs.size()[-1] != self.dims:
             raise TypeError(f"input vectors must have size {self.dims}")
 
-        # Linearly transform inputs in three ways to get queries, keys, values
-        queries = bmv(self.W_Q, inputs)
-        keys = bmv(self.W_K, inputs)
-        values = bmv(self.W_V, inputs)
+        # Linearly transform inputs in three ways (with one fused
+        # matmul) to get queries, keys, values
+        queries, keys, values = self.project_qkv(inputs)
+
+        # Compute output vectors; the causal mask is applied inside the
+        # fused attention kernel rather than built here on every call
+        outputs = attention(queries, keys, values, causal=True)
 
-        # Compute output vectors
-        mask = torch.arange(n).unsqueeze(1) < torch.arange(n)
-        mask = mask.to(device)
-        outputs = attention(queries, keys, values, mask=mask)
-        del mask
-        
         # Residual connection (see RNN for explanation)
         outputs = outputs + inputs
-        
+
         return outputs
 
 class MaskedSelfAttentionLayerTemp(AttentionLayer):
@@ -496,26 +726,37 @@ class MaskedSelfAttentionLayerTemp(AttentionLayer):
     methods.
     """
 
-    def start(self):
-        """The state is the list of previous inputs, which is initially empty."""
-        return torch.empty(0, self.dims)
+    def start(self, max_len=256):
+        """The state is a pair of key and value caches, preallocated to
+        max_len positions (they grow if needed), plus the number of
+        positions filled so far."""
+        K = self.W_K.new_empty(max_len, self.dims)
+        V = self.W_V.new_empty(max_len, self.dims)
+        return (K, V, 0)
 
-    def step(self, prev_inps, inp):
-        """Input a new vector and compute masked self-attention over all input vectors."""
-        inputs = torch.cat([prev_inps, inp.unsqueeze(0)], dim=0)
+    def step(self, state, inp):
+        """Input a new vector and compute masked self-attention over all
+        input vectors so far.
 
-        # Linearly transform inputs in three ways to get queries, keys, values
-        query = bmv(self.W_Q, inp)
-        keys = bmv(self.W_K, inputs)
-        values = bmv(self.W_V, inputs)
+        The keys and values of previous positions are reused from the
+        cache (see MaskedSelfAttentionLayer.step), so each step projects
+        only the new input vector and there is no per-step torch.cat."""
+        K, V, t = state
+        if t == K.size(0):
+            K = torch.cat([K, K.new_empty(K.size(0), self.dims)], dim=0)
+            V = torch.cat([V, V.new_empty(V.size(0), self.dims)], dim=0)
 
-        # Compute output vectors
-        output = attention(query, keys, values)
+        # Linearly transform the new input in three ways (with one
+        # fused matvec) to get the query and the new key and value
+        query, K[t], V[t] = self.project_qkv(inp)
+
+        # Compute output vector
+        output = attention(query, K[:t+1], V[:t+1])
 
         # Residual connection
         output = output + inp
 
-        return (inputs, output)
+        return ((K, V, t+1), output)
 
     def forward(self, inputs, ):
         """Argument:
@@ -531,19 +772,16 @@ class MaskedSelfAttentionLayerTemp(AttentionLayer):
         if inputs.size()[-1] != self.dims:
             raise TypeError(f"input vectors must have size {self.dims}")
 
-        # Linearly transform inputs in three ways to get queries, keys, values
-        queries = bmv(self.W_Q, inputs)
-        keys = bmv(self.W_K, inputs)
-        values = bmv(self.W_V, inputs)
+        # Linearly transform inputs in three ways (with one fused
+        # matmul) to get queries, keys, values
+        queries, keys, values = self.project_qkv(inputs)
 
         # get 1/n^3 temperature
         temp = 1/(n**3)
 
-        # Compute output vectors
-        mask = torch.arange(n).unsqueeze(1) < torch.arange(n)
-        mask = mask.to(device)
-        outputs = attention(queries, keys, values, mask=mask, temp=temp)
-        del mask
+        # Compute output vectors; the causal mask is applied inside the
+        # fused attention kernel rather than built here on every call
+        outputs = attention(queries, keys, values, temp=temp, causal=True)
 
         # Residual connection (see RNN for explanation)
         outputs = outputs + inputs
@@ -559,6 +797,7 @@ class CrossAttentionLayer(AttentionLayer):
     The resulting object is callable (see forward()).
     """
     
+    @compiled
     def forward(self, finputs, einputs):
         """Arguments:
             finputs: Source-side input vectors (tensor of size n,d)
@@ -575,27 +814,54 @@ class CrossAttentionLayer(AttentionLayer):
         if einputs.size()[-1] != self.dims:
             raise TypeError(f"einputs vectors must have size {self.dims}")
 
-        # Linearly transform inputs in three ways to get queries, keys, values
-        queries = bmv(self.W_Q, einputs)
-        keys = bmv(self.W_K, finputs)
-        values = bmv(self.W_V, finputs)
+        # On GPU, run the projections and attention in bfloat16 (see
+        # SelfAttentionLayer.forward)
+        with torch.autocast('cuda', dtype=torch.bfloat16, enabled=finputs.is_cuda):
+            # Linearly transform inputs in three ways to get queries,
+            # keys, values; the key and value projections share an input
+            # so they are done with one fused matmul
+            queries = torch.nn.functional.linear(einputs, self.W_Q)
+            keys, values = torch.nn.functional.linear(
+                finputs, self.W_QKV[self.dims:]).chunk(2, dim=-1)
+
+            # Compute output vectors
+            outputs = attention(queries, keys, values)
 
-        # Compute output vectors
-        outputs = attention(queries, keys, values)
-        
         # Residual connection (see RNN for explanation)
         outputs = outputs + einputs
-        
+
         return outputs
     
 class MHSelfAttentionLayer(torch.nn.Module):
-    """Multi-head self-attention layer."""
+    """Multi-head self-attention layer.
+
+    The heads' weights are stored stacked (nheads,dims,dims) so that
+    all heads are computed with batched matmuls instead of running
+    nheads separate attention layers. The output is the average of the
+    heads' outputs plus a residual connection, which matches averaging
+    nheads independent SelfAttentionLayers."""
     def __init__(self, nheads, dims):
         super().__init__()
-        self.heads = torch.nn.ModuleList([SelfAttentionLayer(dims) for h in range(nheads)])
+        self.nheads = nheads
+        self.dims = dims
+        self.W_Q = torch.nn.Parameter(torch.randn(nheads, dims, dims) * 0.01)
+        self.W_K = torch.nn.Parameter(torch.randn(nheads, dims, dims) * 0.01)
+        self.W_V = torch.nn.Parameter(torch.randn(nheads, dims, dims) * 0.01)
 
     def forward(self, inp):
-        return sum([h(inp) for h in self.heads]) / len(self.heads)
+        # On GPU, run the projections and attention in bfloat16 (see
+        # SelfAttentionLayer.forward)
+        with torch.autocast('cuda', dtype=torch.bfloat16, enabled=inp.is_cuda):
+            # h = head, n = position, i/j = vector components
+            queries = torch.einsum('hij,nj->hni', self.W_Q, inp)
+            keys = torch.einsum('hij,nj->hni', self.W_K, inp)
+            values = torch.einsum('hij,nj->hni', self.W_V, inp)
+
+            # attention() broadcasts over the head axis
+            outputs = attention(queries, keys, values)
+
+        # Average the heads; residual connection (see RNN for explanation)
+        return outputs.mean(dim=0) + inp
 
 class FFN(torch.nn.Module):
     def __init__(self, idims, hdims, odims, residual=True):
@@ -605,9 +871,69 @@ class FFN(torch.nn.Module):
         self.residual = residual
 
     def forward(self, inp):
-        hid = torch.relu(self.lin1(inp))
-        out = self.lin2(hid)
+        # Use the LinearLayer weights directly so the whole block --
+        # matmul, ReLU, matmul, residual -- is one compiled region,
+        # letting the compiler fuse the activation and residual into
+        # the matmuls as epilogues instead of reloading the (large)
+        # hidden activation from memory.
+        # On GPU, run both matmuls in bfloat16 (see SelfAttentionLayer.forward)
+        with torch.autocast('cuda', dtype=torch.bfloat16, enabled=inp.is_cuda):
+            hid = torch.relu(torch.nn.functional.linear(inp, self.lin1.W, self.lin1.b))
+            out = torch.nn.functional.linear(hid, self.lin2.W, self.lin2.b)
         if self.residual:
             return inp + out
         else:
             return out
+
+    # max-autotune searches more aggressive matmul/epilogue-fusion
+    # configurations than the default; cudagraphs stay off because the
+    # sequence length varies per call
+    forward = compiled(forward, mode='max-autotune-no-cudagraphs')
+
+class CUDAGraphStep:
+    """Capture a decoder step as a CUDA graph and replay it.
+
+    Autoregressive decoding runs many small kernels per token (attention
+    steps, FFN, softmax), so on GPU each token pays dozens of kernel
+    launches. This wrapper records one step with torch.cuda.CUDAGraph
+    after a few warmup runs; every later call just copies the new
+    arguments into the captured buffers and replays the whole graph as
+    a single launch.
+
+    The step function must be shape-stable: every call has to read and
+    write tensors of the same sizes, e.g. attention caches preallocated
+    to their maximum length (see MaskedSelfAttentionLayer.start) with
+    the position kept in a tensor rather than Python slicing. All
+    tensor arguments must be on the GPU.
+
+    Usage:
+        step = CUDAGraphStep(fn, example_args)
+        out = step(*args)   # same shapes as example_args
+    """
+
+    def __init__(self, fn, example_args, warmup=3):
+        if not torch.cuda.is_available():
+            raise RuntimeError("CUDAGraphStep requires a GPU")
+
+        # Static buffers: the graph is captured reading these, so later
+        # calls write their arguments into them before replaying
+        self.static_args = [a.clone() for a in example_args]
+
+        # Warm up on a side stream so lazy initialization (cuBLAS
+        # handles, autotuning) doesn't get captured into the graph
+        stream = torch.cuda.Stream()
+        stream.wait_stream(torch.cuda.current_stream())
+        with torch.cuda.stream(stream):
+            for _ in range(warmup):
+                fn(*self.static_args)
+        torch.cuda.current_stream().wait_stream(stream)
+
+        self.graph = torch.cuda.CUDAGraph()
+        with torch.cuda.graph(self.graph):
+            self.static_out = fn(*self.static_args)
+
+    def __call__(self, *args):
+        for buf, arg in zip(self.static_args, args):
+            buf.copy_(arg)
+        self.graph.replay()
+        return self.static_out